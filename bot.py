@@ -12,11 +12,16 @@ import uuid
 import aiohttp
 import sys
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.methods import SendPhoto, SendDocument, EditMessageText, EditMessageReplyMarkup
+from aiogram.types import (
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+    InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
+)
 
 # Добавляем папку проекта в путь
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -25,7 +30,11 @@ try:
     from config.settings import (
         API_TOKEN, COMFY_URL, WORKFLOW_FILE,
         ROOMS, STYLES, LIGHTING, BASE_QUALITY, NEGATIVE_PROMPT,
-        DEBUG, LOG_LEVEL
+        DEBUG, LOG_LEVEL,
+        OUTPUT_FORMAT, OUTPUT_QUALITY, OUTPUT_MIN_QUALITY, OUTPUT_MAX_SIDE,
+        OUTPUT_MAX_BYTES, OUTPUT_WORKERS, OUTPUT_COMFY_PREVIEW,
+        ORIGINALS_LIMIT, ORIGINALS_TTL,
+        TG_GLOBAL_RATE, TG_CHAT_INTERVAL, TG_GROUP_INTERVAL, TG_MAX_RETRIES
     )
 except ImportError as e:
     # Запасные значения если config не загрузился
@@ -42,6 +51,22 @@ except ImportError as e:
     NEGATIVE_PROMPT = "low quality"
     DEBUG = False
     LOG_LEVEL = "INFO"
+    OUTPUT_FORMAT = "JPEG"
+    OUTPUT_QUALITY = 85
+    OUTPUT_MIN_QUALITY = 50
+    OUTPUT_MAX_SIDE = 2560
+    OUTPUT_MAX_BYTES = 10 * 1024 * 1024
+    OUTPUT_WORKERS = 2
+    OUTPUT_COMFY_PREVIEW = True
+    ORIGINALS_LIMIT = 1000
+    ORIGINALS_TTL = 24 * 60 * 60
+    TG_GLOBAL_RATE = 25
+    TG_CHAT_INTERVAL = 1.0
+    TG_GROUP_INTERVAL = 3.0
+    TG_MAX_RETRIES = 5
+
+from image_output import OutputEncoder, OriginalRefs
+from send_scheduler import SendScheduler, PRIORITY_RESULT, PRIORITY_PROGRESS
 
 # === НАСТРОЙКА ЛОГИРОВАНИЯ ===
 logging.basicConfig(
@@ -67,12 +92,52 @@ class ComfyUIClient:
             logger.error(f"Ошибка подключения к ComfyUI: {e}")
             return False
     
+    async def get_image(self, filename, subfolder="", folder_type="output", preview=None):
+        """Скачивает изображение через /view (preview - сжатие на стороне ComfyUI)"""
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        if preview:
+            params["preview"] = preview
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.get(f"http://{self.base_url}/view", params=params) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+    
+    async def get_image_size(self, filename, subfolder="", folder_type="output"):
+        """Размер оригинала без скачивания (HEAD /view), None если неизвестен"""
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        try:
+            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+                async with session.head(f"http://{self.base_url}/view", params=params) as resp:
+                    resp.raise_for_status()
+                    return resp.content_length
+        except Exception as e:
+            logger.warning(f"Не удалось узнать размер оригинала, экономия неизвестна: {e}")
+            return None
+    
     # ... остальные методы класса ComfyUIClient ...
 
 # === ИНИЦИАЛИЗАЦИЯ ===
 comfy_client = ComfyUIClient(COMFY_URL)
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher(storage=MemoryStorage())
+sender = SendScheduler(
+    bot,
+    global_rate=TG_GLOBAL_RATE,
+    chat_interval=TG_CHAT_INTERVAL,
+    group_interval=TG_GROUP_INTERVAL,
+    max_retries=TG_MAX_RETRIES
+)
+output_encoder = OutputEncoder(
+    fmt=OUTPUT_FORMAT,
+    quality=OUTPUT_QUALITY,
+    min_quality=OUTPUT_MIN_QUALITY,
+    max_side=OUTPUT_MAX_SIDE,
+    max_bytes=OUTPUT_MAX_BYTES,
+    workers=OUTPUT_WORKERS
+)
+
+# Оригиналы для кнопки "Оригинал (PNG)"
+original_refs = OriginalRefs(limit=ORIGINALS_LIMIT, ttl=ORIGINALS_TTL)
 
 # === СОСТОЯНИЯ FSM ===
 class GenerationStates(StatesGroup):
@@ -90,11 +155,69 @@ def make_keyboard(items):
         keyboard.append([KeyboardButton(text=item) for item in row])
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
+async def reply(message, text, **kwargs):
+    """Ответ в чат через планировщик отправки"""
+    return await sender.send(message.answer(text, **kwargs))
+
+async def update_progress(chat_id, message_id, text):
+    """Правка сообщения с прогрессом (неотправленные правки склеиваются)"""
+    try:
+        return await sender.send(
+            EditMessageText(chat_id=chat_id, message_id=message_id, text=text),
+            priority=PRIORITY_PROGRESS
+        )
+    except TelegramBadRequest as e:
+        # Повтор того же текста - не ошибка
+        if "message is not modified" not in str(e):
+            raise
+
+def format_size(size):
+    """Размер в человекочитаемом виде"""
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} МБ"
+    return f"{size / 1024:.0f} КБ"
+
+async def send_result(chat_id, image, caption=None):
+    """
+    Отправляет результат генерации сжатым превью.
+    image - запись из outputs истории ComfyUI (filename, subfolder, type).
+    Оригинал PNG скачивается только по кнопке.
+    """
+    filename = image["filename"]
+    subfolder = image.get("subfolder", "")
+    folder_type = image.get("type", "output")
+
+    original_size = None
+    preview = None
+    if OUTPUT_COMFY_PREVIEW:
+        preview = output_encoder.comfy_preview
+        original_size = await comfy_client.get_image_size(filename, subfolder, folder_type)
+    data = await comfy_client.get_image(filename, subfolder, folder_type, preview=preview)
+    if preview is None:
+        # Пришел сам оригинал
+        original_size = len(data)
+    encoded, as_photo = await output_encoder.prepare(data, original_size)
+
+    ref = original_refs.remember((filename, subfolder, folder_type))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📎 Оригинал (PNG)", callback_data=f"orig:{ref}")
+    ]])
+
+    name = f"{os.path.splitext(filename)[0]}.{output_encoder.extension}"
+    media = BufferedInputFile(encoded, filename=name)
+    if as_photo:
+        method = SendPhoto(chat_id=chat_id, photo=media, caption=caption, reply_markup=keyboard)
+    else:
+        # Слишком вытянутое изображение send_photo отклонит
+        method = SendDocument(chat_id=chat_id, document=media, caption=caption, reply_markup=keyboard)
+    return await sender.send(method, priority=PRIORITY_RESULT)
+
 # === КОМАНДЫ БОТА ===
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     """Начало работы с ботом"""
-    await message.answer(
+    await reply(
+        message,
         "👋 *Привет! Я превращаю эскизы в фотореалистичные рендеры.*\n\n"
         "📋 *Как это работает:*\n"
         "1. Отправь мне фото эскиза комнаты\n"
@@ -128,7 +251,7 @@ async def cmd_help(message: types.Message):
 
 🆘 *Поддержка:* Свяжитесь с разработчиком
     """
-    await message.answer(help_text, parse_mode="Markdown")
+    await reply(message, help_text, parse_mode="Markdown")
 
 @dp.message(Command("status"))
 async def cmd_status(message: types.Message):
@@ -136,30 +259,37 @@ async def cmd_status(message: types.Message):
     try:
         # Проверяем подключение к ComfyUI
         is_connected = await comfy_client.check_connection()
+        metrics = output_encoder.metrics.snapshot()
+        queue = sender.stats()
         
         status_text = f"""
 🤖 *Статус бота:*
 ✅ Активен и работает
 🌐 ComfyUI: {'✅ Доступен' if is_connected else '❌ Недоступен'}
 📡 Serveo URL: `{COMFY_URL}`
+🖼️ Отправлено превью: {metrics['images']} ({format_size(metrics['bytes_out'])})
+💾 Сэкономлено: {format_size(metrics['bytes_saved'])} (без учета: {metrics['unmeasured']})
+📎 Запрошено оригиналов: {metrics['originals_requested']}
+📨 Очередь отправки: {queue['queued']} (чатов: {queue['chats']})
 🔧 Готов к работе!
 
 💡 *Совет:* Используй /start чтобы начать
         """
-        await message.answer(status_text, parse_mode="Markdown")
+        await reply(message, status_text, parse_mode="Markdown")
     except Exception as e:
-        await message.answer(f"❌ Ошибка получения статуса: {str(e)[:100]}")
+        await reply(message, f"❌ Ошибка получения статуса: {str(e)[:100]}")
 
 @dp.message(Command("connect"))
 async def cmd_connect(message: types.Message):
     """Проверка подключения к ComfyUI"""
     try:
-        await message.answer("🔍 Проверяю подключение к нейросети...")
+        await reply(message, "🔍 Проверяю подключение к нейросети...")
         
         is_connected = await comfy_client.check_connection()
         
         if is_connected:
-            await message.answer(
+            await reply(
+                message,
                 f"✅ *Подключение установлено!*\n\n"
                 f"🌐 URL: `{COMFY_URL}`\n"
                 f"📡 Статус: Доступен\n"
@@ -168,7 +298,8 @@ async def cmd_connect(message: types.Message):
                 parse_mode="Markdown"
             )
         else:
-            await message.answer(
+            await reply(
+                message,
                 f"❌ *Не удалось подключиться*\n\n"
                 f"🌐 URL: `{COMFY_URL}`\n"
                 f"💡 *Что проверить:*\n"
@@ -181,7 +312,7 @@ async def cmd_connect(message: types.Message):
                 parse_mode="Markdown"
             )
     except Exception as e:
-        await message.answer(f"❌ Ошибка проверки: {str(e)[:100]}")
+        await reply(message, f"❌ Ошибка проверки: {str(e)[:100]}")
 
 @dp.message(Command("cancel"))
 async def cmd_cancel(message: types.Message, state: FSMContext):
@@ -189,12 +320,13 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
     if current_state:
         await state.clear()
-        await message.answer(
+        await reply(
+            message,
             "✅ Операция отменена.\nИспользуй /start чтобы начать заново.",
             reply_markup=ReplyKeyboardRemove()
         )
     else:
-        await message.answer("Нет активных операций для отмены.")
+        await reply(message, "Нет активных операций для отмены.")
 
 # === ОСНОВНЫЕ ОБРАБОТЧИКИ ===
 @dp.message(GenerationStates.waiting_for_photo, F.photo)
@@ -209,7 +341,8 @@ async def process_photo(message: types.Message, state: FSMContext):
         await bot.download_file(file.file_path, filename)
         
         await state.update_data(image_path=filename)
-        await message.answer(
+        await reply(
+            message,
             "✅ Фото получено!\n\nТеперь выбери *тип комнаты:*",
             parse_mode="Markdown",
             reply_markup=make_keyboard(list(ROOMS.keys()))
@@ -218,10 +351,52 @@ async def process_photo(message: types.Message, state: FSMContext):
         
     except Exception as e:
         logger.error(f"Ошибка обработки фото: {e}")
-        await message.answer("❌ Ошибка загрузки фото. Попробуйте еще раз.")
+        await reply(message, "❌ Ошибка загрузки фото. Попробуйте еще раз.")
 
 # ... остальные обработчики (process_room, process_style, process_light) ...
 
+@dp.callback_query(F.data.startswith("orig:"))
+async def send_original(callback: types.CallbackQuery):
+    """Отправка оригинала без потерь по запросу"""
+    ref_id = callback.data.split(":", 1)[1]
+    ref = original_refs.take(ref_id)
+    if not ref:
+        if original_refs.is_taken(ref_id):
+            await callback.answer("⏳ Оригинал уже загружается...")
+        else:
+            await callback.answer("❌ Оригинал больше недоступен", show_alert=True)
+        return
+
+    await callback.answer("⏳ Загружаю оригинал...")
+    chat_id = callback.message.chat.id
+    message_id = callback.message.message_id
+    try:
+        filename, subfolder, folder_type = ref
+        data = await comfy_client.get_image(filename, subfolder, folder_type)
+        await sender.send(
+            SendDocument(
+                chat_id=chat_id,
+                document=BufferedInputFile(data, filename=filename),
+                reply_to_message_id=message_id
+            ),
+            priority=PRIORITY_RESULT
+        )
+    except Exception as e:
+        logger.error(f"Ошибка загрузки оригинала: {e}")
+        original_refs.restore(ref_id)
+        await reply(callback.message, "❌ Не удалось загрузить оригинал. Попробуйте позже.")
+        return
+
+    original_refs.release(ref_id)
+    output_encoder.metrics.record_original(len(data))
+    try:
+        # Оригинал отправлен - убираем кнопку
+        await sender.send(
+            EditMessageReplyMarkup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось убрать кнопку оригинала: {e}")
+
 async def main():
     """Основная функция запуска"""
     logger.info("=" * 50)
@@ -256,6 +431,13 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Ошибка запуска бота: {e}")
     finally:
+        await sender.stop()
+        output_encoder.shutdown()
+        metrics = output_encoder.metrics.snapshot()
+        logger.info(
+            f"🖼️ Превью: {metrics['images']}, "
+            f"сэкономлено {format_size(metrics['bytes_saved'])}"
+        )
         await bot.session.close()
 
 # Точка входа для запуска из app.py
@@ -28,6 +28,34 @@ PORT = int(os.getenv('PORT', 10000))
 # === ПУТИ К ФАЙЛАМ ===
 WORKFLOW_FILE = "sd35_sketch_to_renderV3.json"
 
+# === ВЫДАЧА РЕЗУЛЬТАТА ===
+# Превью для send_photo: формат JPEG или WEBP
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'JPEG').upper()
+OUTPUT_QUALITY = int(os.getenv('OUTPUT_QUALITY', 85))
+# Минимальное качество, до которого можно опуститься ради лимита размера
+OUTPUT_MIN_QUALITY = int(os.getenv('OUTPUT_MIN_QUALITY', 50))
+# Длинная сторона превью (Telegram: ширина + высота <= 10000)
+OUTPUT_MAX_SIDE = int(os.getenv('OUTPUT_MAX_SIDE', 2560))
+# Лимит Telegram для send_photo - 10 МБ
+OUTPUT_MAX_BYTES = int(os.getenv('OUTPUT_MAX_BYTES', 10 * 1024 * 1024))
+# Процессы для перекодирования
+OUTPUT_WORKERS = int(os.getenv('OUTPUT_WORKERS', 2))
+# Просить ComfyUI отдать сжатое превью (/view?preview=...), чтобы не гнать PNG через Serveo
+OUTPUT_COMFY_PREVIEW = os.getenv('OUTPUT_COMFY_PREVIEW', 'true').lower() == 'true'
+# Сколько кнопок "Оригинал" помнить и как долго (сек)
+ORIGINALS_LIMIT = int(os.getenv('ORIGINALS_LIMIT', 1000))
+ORIGINALS_TTL = int(os.getenv('ORIGINALS_TTL', 24 * 60 * 60))
+
+# === ЛИМИТЫ ОТПРАВКИ В TELEGRAM ===
+# Запросов в секунду на весь бот (лимит Telegram ~30)
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 25))
+# Минимальный интервал между сообщениями в один чат, сек
+TG_CHAT_INTERVAL = float(os.getenv('TG_CHAT_INTERVAL', 1.0))
+# Для групп лимит строже: 20 сообщений в минуту
+TG_GROUP_INTERVAL = float(os.getenv('TG_GROUP_INTERVAL', 3.0))
+# Сколько раз повторять запрос после 429 (retry_after)
+TG_MAX_RETRIES = int(os.getenv('TG_MAX_RETRIES', 5))
+
 # === НАСТРОЙКИ БОТА ===
 # Комнаты (Русское -> Английское)
 ROOMS = {
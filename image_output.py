@@ -0,0 +1,271 @@
+"""
+Подготовка результата ComfyUI к отправке в Telegram
+Перекодирование PNG в JPEG/WebP в пуле процессов + метрики экономии
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Жесткие ограничения Telegram для send_photo
+TELEGRAM_MAX_SIDE_SUM = 10000
+TELEGRAM_MAX_RATIO = 20
+
+
+def encode_preview(data, fmt="JPEG", quality=85, min_quality=50,
+                   max_side=2560, max_bytes=10 * 1024 * 1024):
+    """
+    Перекодирует изображение в превью для send_photo.
+    Выполняется в отдельном процессе, поэтому функция верхнего уровня.
+    Возвращает (байты, ширина, высота).
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    # Длинная сторона не больше max_side и сумма сторон в пределах лимита
+    side = min(max_side, TELEGRAM_MAX_SIDE_SUM // 2)
+    if max(image.size) > side:
+        image.thumbnail((side, side), Image.LANCZOS)
+
+    width, height = image.size
+
+    # Понижаем качество, пока не влезем в лимит
+    quality = max(quality, min_quality)
+    while True:
+        buffer = io.BytesIO()
+        if fmt == "WEBP":
+            image.save(buffer, "WEBP", quality=quality, method=4)
+        else:
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        encoded = buffer.getvalue()
+        if len(encoded) <= max_bytes or quality <= min_quality:
+            break
+        quality = max(quality - 10, min_quality)
+
+    if len(encoded) > max_bytes:
+        # Последний шаг - уменьшаем разрешение вдвое
+        image.thumbnail((width // 2, height // 2), Image.LANCZOS)
+        return encode_preview(
+            _to_png(image), fmt, min_quality, min_quality,
+            max(image.size), max_bytes
+        )
+
+    return encoded, width, height
+
+
+def fits_photo(width, height):
+    """Примет ли send_photo изображение с такими сторонами"""
+    return (
+        width + height <= TELEGRAM_MAX_SIDE_SUM
+        and max(width, height) <= TELEGRAM_MAX_RATIO * min(width, height)
+    )
+
+
+def _to_png(image):
+    """Сериализует промежуточное изображение без потерь"""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class OutputMetrics:
+    """
+    Счетчики выдачи: сколько байт получили и сколько отправили.
+    Превью с неизвестным размером оригинала в экономию не попадают.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.unmeasured = 0
+        self._measured_out = 0
+        self.originals_requested = 0
+        self.originals_bytes = 0
+
+    def record_preview(self, bytes_in, bytes_out):
+        """bytes_in=None - размер оригинала неизвестен"""
+        with self._lock:
+            self.images += 1
+            self.bytes_out += bytes_out
+            if bytes_in is None:
+                self.unmeasured += 1
+                return
+            self.bytes_in += bytes_in
+            self._measured_out += bytes_out
+
+    def record_original(self, size):
+        with self._lock:
+            self.originals_requested += 1
+            self.originals_bytes += size
+
+    @property
+    def bytes_saved(self):
+        return max(self.bytes_in - self._measured_out, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_saved,
+                "unmeasured": self.unmeasured,
+                "originals_requested": self.originals_requested,
+                "originals_bytes": self.originals_bytes,
+            }
+
+
+class OriginalRefs:
+    """
+    Ссылки на оригиналы для кнопки "Оригинал" (callback_data ограничена 64 байтами).
+    Хранится не больше limit ссылок, каждая живет ttl секунд.
+    """
+
+    def __init__(self, limit=1000, ttl=24 * 60 * 60, clock=time.monotonic):
+        self.limit = limit
+        self.ttl = ttl
+        self._clock = clock
+        self._refs = OrderedDict()
+        # Ссылки, по которым оригинал сейчас загружается
+        self._taken = {}
+
+    def __len__(self):
+        return len(self._refs)
+
+    def remember(self, image):
+        """Запоминает оригинал, старые и лишние ссылки удаляются"""
+        now = self._clock()
+        while self._refs:
+            ref, (_, created) = next(iter(self._refs.items()))
+            if len(self._refs) < self.limit and now - created < self.ttl:
+                break
+            self._refs.pop(ref)
+
+        ref = uuid.uuid4().hex[:16]
+        self._refs[ref] = (image, now)
+        return ref
+
+    def take(self, ref):
+        """
+        Забирает ссылку на время загрузки, чтобы повторное нажатие
+        не скачивало оригинал второй раз. None - ссылки нет или устарела.
+        """
+        entry = self._refs.pop(ref, None)
+        if entry is None:
+            return None
+        image, created = entry
+        if self._clock() - created >= self.ttl:
+            return None
+        self._taken[ref] = entry
+        return image
+
+    def is_taken(self, ref):
+        return ref in self._taken
+
+    def restore(self, ref):
+        """Возвращает ссылку после неудачной загрузки"""
+        entry = self._taken.pop(ref, None)
+        if entry is not None:
+            self._refs[ref] = entry
+
+    def release(self, ref):
+        """Оригинал отправлен - ссылка больше не нужна"""
+        self._taken.pop(ref, None)
+
+
+class OutputEncoder:
+    """Пул процессов для перекодирования результатов"""
+
+    def __init__(self, fmt="JPEG", quality=85, min_quality=50,
+                 max_side=2560, max_bytes=10 * 1024 * 1024, workers=2):
+        if fmt not in ("JPEG", "WEBP"):
+            raise ValueError(f"❌ Неподдерживаемый формат превью: {fmt}")
+        self.fmt = fmt
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.metrics = OutputMetrics()
+        self._executor = None
+
+    @property
+    def extension(self):
+        return "webp" if self.fmt == "WEBP" else "jpg"
+
+    @property
+    def comfy_preview(self):
+        """Значение параметра preview для /view в ComfyUI"""
+        return f"{self.fmt.lower()};{self.quality}"
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Бот работает в потоке рядом с Flask - fork многопоточного процесса
+            # может унаследовать захваченные блокировки, поэтому spawn
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _needs_encode(self, image_format, width, height, size):
+        return (
+            image_format != self.fmt
+            or size > self.max_bytes
+            or max(width, height) > self.max_side
+        )
+
+    async def prepare(self, data, original_size):
+        """
+        Готовит превью к отправке, не блокируя event loop.
+        Уже сжатое ComfyUI превью в пределах лимитов отправляется как есть.
+        original_size - размер оригинала для метрик (len(data), если пришел
+        сам оригинал; None, если размер узнать не удалось).
+        Возвращает (байты, можно ли отправить через send_photo).
+        """
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            width, height = image.size
+
+        encoded = data
+        if self._needs_encode(image_format, width, height, len(data)):
+            loop = asyncio.get_running_loop()
+            encoded, width, height = await loop.run_in_executor(
+                self._get_executor(), encode_preview, data,
+                self.fmt, self.quality, self.min_quality, self.max_side, self.max_bytes
+            )
+
+        self.metrics.record_preview(original_size, len(encoded))
+        if original_size is None:
+            logger.info(
+                f"🖼️ Превью {width}x{height} {self.fmt}: "
+                f"{len(encoded) // 1024} КБ, экономия неизвестна"
+            )
+        else:
+            logger.info(
+                f"🖼️ Превью {width}x{height} {self.fmt}: "
+                f"{original_size // 1024} КБ -> {len(encoded) // 1024} КБ"
+            )
+        return encoded, fits_photo(width, height)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,286 @@
+"""
+Планировщик исходящих запросов к Telegram
+Глобальный и per-chat лимиты, приоритеты, склейка правок прогресса, retry_after
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше - важнее)
+PRIORITY_RESULT = 0    # готовые рендеры и оригиналы
+PRIORITY_MESSAGE = 1   # ответы на команды, клавиатуры
+PRIORITY_PROGRESS = 2  # правки сообщений с прогрессом
+
+# Правки, которые можно склеивать: до отправки важна только последняя
+COALESCED_EDITS = (EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup)
+
+
+class _Job:
+    """Один исходящий запрос и все, кто ждет его результат"""
+
+    __slots__ = ("method", "priority", "seq", "key", "futures", "attempts")
+
+    def __init__(self, method, priority, seq, key):
+        self.method = method
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.futures = []
+        self.attempts = 0
+
+
+class _ChatQueue:
+    """Очереди одного чата по приоритетам"""
+
+    __slots__ = ("lanes", "next_allowed", "busy")
+
+    def __init__(self):
+        self.lanes = {}
+        self.next_allowed = 0.0
+        # Пока запрос чата в полете, следующий не отправляем - сохраняем порядок
+        self.busy = False
+
+    def head(self):
+        """Самый приоритетный запрос чата"""
+        best = None
+        for lane in self.lanes.values():
+            if lane and (best is None or (lane[0].priority, lane[0].seq) < (best.priority, best.seq)):
+                best = lane[0]
+        return best
+
+    def is_empty(self):
+        return not any(self.lanes.values())
+
+
+class SendScheduler:
+    """
+    Обертка над Bot для всех исходящих запросов.
+
+    Принимает объекты методов aiogram (SendMessage, EditMessageText, ...),
+    например результат message.answer(...) без await. Метод обязан иметь
+    chat_id: AnswerCallbackQuery, inline-правки и т.п. вызываются напрямую.
+    Запросы одного чата уходят строго по одному.
+    """
+
+    def __init__(self, bot, global_rate=25, chat_interval=1.0,
+                 group_interval=3.0, max_retries=5):
+        if global_rate <= 0:
+            raise ValueError(f"❌ TG_GLOBAL_RATE должен быть больше 0: {global_rate}")
+        if chat_interval < 0 or group_interval < 0:
+            raise ValueError(
+                f"❌ TG_CHAT_INTERVAL и TG_GROUP_INTERVAL не могут быть отрицательными: "
+                f"{chat_interval}, {group_interval}"
+            )
+        self.bot = bot
+        self.global_interval = 1.0 / global_rate
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+
+        self._chats = {}
+        self._pending_edits = {}
+        self._seq = itertools.count()
+        self._global_next = 0.0
+        self._wakeup = None
+        self._task = None
+        self._inflight = set()
+
+    # === ПУБЛИЧНЫЙ ИНТЕРФЕЙС ===
+    async def send(self, method, priority=PRIORITY_MESSAGE):
+        """Ставит запрос в очередь и ждет ответ Telegram"""
+        self._ensure_started()
+        return await self._enqueue(method, priority)
+
+    async def stop(self):
+        """Останавливает диспетчер, незавершенные запросы отменяются"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._inflight:
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        self._inflight.clear()
+        for chat in self._chats.values():
+            for lane in chat.lanes.values():
+                for job in lane:
+                    for future in job.futures:
+                        future.cancel()
+        self._chats.clear()
+        self._pending_edits.clear()
+
+    def stats(self):
+        """Размер очередей для /status"""
+        return {
+            "chats": len(self._chats),
+            "queued": sum(
+                len(lane) for chat in self._chats.values() for lane in chat.lanes.values()
+            ),
+        }
+
+    # === ОЧЕРЕДИ ===
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    def _edit_key(self, method):
+        """Ключ склейки: правки одного типа для одного сообщения"""
+        if not isinstance(method, COALESCED_EDITS) or method.message_id is None:
+            return None
+        return (type(method), method.chat_id, method.message_id)
+
+    def _enqueue(self, method, priority):
+        if getattr(method, "chat_id", None) is None:
+            raise ValueError(f"❌ {type(method).__name__} без chat_id нельзя поставить в очередь")
+
+        future = asyncio.get_running_loop().create_future()
+        key = self._edit_key(method)
+
+        pending = self._pending_edits.get(key) if key else None
+        if pending is not None:
+            # Еще не отправленная правка того же сообщения - оставляем только последнюю
+            pending.method = method
+            pending.futures.append(future)
+            return future
+
+        job = _Job(method, priority, next(self._seq), key)
+        job.futures.append(future)
+        self._push(job)
+        return future
+
+    def _push(self, job, front=False):
+        chat = self._chats.setdefault(job.method.chat_id, _ChatQueue())
+        lane = chat.lanes.setdefault(job.priority, deque())
+        if front:
+            lane.appendleft(job)
+        else:
+            lane.append(job)
+        if job.key is not None:
+            self._pending_edits[job.key] = job
+        self._wakeup.set()
+
+    def _interval(self, chat_id):
+        # Отрицательные id - группы и каналы, у них лимит строже
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self.group_interval
+        return self.chat_interval
+
+    def _pick(self, now):
+        """Выбирает самый приоритетный запрос среди чатов, которым можно отправлять"""
+        best_chat_id, best_job, next_wake = None, None, None
+        for chat_id, chat in list(self._chats.items()):
+            head = chat.head()
+            if chat.busy:
+                continue
+            if head is None:
+                if chat.next_allowed <= now:
+                    del self._chats[chat_id]
+                continue
+            if chat.next_allowed > now:
+                if next_wake is None or chat.next_allowed < next_wake:
+                    next_wake = chat.next_allowed
+                continue
+            if best_job is None or (head.priority, head.seq) < (best_job.priority, best_job.seq):
+                best_chat_id, best_job = chat_id, head
+        return best_chat_id, best_job, next_wake
+
+    # === ДИСПЕТЧЕР ===
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self._global_next:
+                await asyncio.sleep(self._global_next - now)
+                continue
+
+            chat_id, job, next_wake = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                timeout = None if next_wake is None else max(next_wake - now, 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat = self._chats[chat_id]
+            chat.lanes[job.priority].popleft()
+            if job.key is not None:
+                self._pending_edits.pop(job.key, None)
+
+            if all(future.done() for future in job.futures):
+                # Все ожидающие отменены - запрос больше никому не нужен
+                continue
+
+            self._global_next = now + self.global_interval
+            chat.busy = True
+            task = asyncio.create_task(self._execute(chat, job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, chat, job):
+        job.attempts += 1
+        try:
+            result = await self.bot(job.method)
+        except TelegramRetryAfter as e:
+            self._retry_later(chat, job, e)
+            return
+        except asyncio.CancelledError:
+            # stop() во время запроса - ожидающие не должны зависнуть
+            for future in job.futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            self._resolve(job, exception=e)
+        else:
+            self._resolve(job, result=result)
+        finally:
+            # Интервал чата считаем от завершения запроса, а не от начала
+            chat.busy = False
+            chat.next_allowed = max(
+                chat.next_allowed,
+                asyncio.get_running_loop().time() + self._interval(job.method.chat_id)
+            )
+            self._wakeup.set()
+
+    def _retry_later(self, chat, job, error):
+        chat_id = job.method.chat_id
+        if job.attempts >= self.max_retries:
+            logger.error(f"❌ Flood wait для чата {chat_id}: попытки исчерпаны")
+            self._resolve(job, exception=error)
+            return
+
+        logger.warning(f"⏳ Flood wait {error.retry_after} сек для чата {chat_id}")
+        chat.next_allowed = asyncio.get_running_loop().time() + error.retry_after
+        # Чат мог быть удален из словаря, пока запрос был в полете
+        self._chats.setdefault(chat_id, chat)
+
+        newer = self._pending_edits.get(job.key) if job.key is not None else None
+        if newer is not None:
+            # Пока ждали, пришла более свежая правка - она ответит всем
+            newer.futures.extend(job.futures)
+            return
+        self._push(job, front=True)
+
+    @staticmethod
+    def _resolve(job, result=None, exception=None):
+        for future in job.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
@@ -0,0 +1,145 @@
+"""
+Превью для Telegram, метрики экономии и ссылки на оригиналы
+"""
+
+import asyncio
+import io
+import os
+import sys
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_output import OriginalRefs, OutputEncoder, encode_preview, fits_photo
+
+
+def make_image(size, fmt="PNG"):
+    """Шумное изображение - плохо сжимается, удобно для лимитов размера"""
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 80).convert("RGB").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def image_size(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_encode_preview_limits_longest_side():
+    encoded, width, height = encode_preview(make_image((1200, 600)), max_side=400)
+    assert (width, height) == (400, 200)
+    assert image_size(encoded) == (400, 200)
+
+
+def test_encode_preview_downscales_when_min_quality_is_too_big():
+    data = make_image((800, 800))
+    encoded, width, height = encode_preview(data, max_bytes=20_000)
+    assert len(encoded) <= 20_000
+    assert width < 800 and height < 800
+    assert image_size(encoded) == (width, height)
+
+
+def test_fits_photo():
+    assert fits_photo(1000, 1000)
+    assert not fits_photo(100, 3000)
+    assert not fits_photo(5000, 5001)
+
+
+def test_prepare_sends_fitting_comfy_preview_as_is():
+    async def scenario():
+        encoder = OutputEncoder(max_side=2560)
+        data = make_image((800, 600), fmt="JPEG")
+        result = await encoder.prepare(data, original_size=5_000_000)
+        return encoder, data, result
+
+    encoder, data, (encoded, as_photo) = run(scenario())
+    assert encoded is data
+    assert as_photo
+    # Пул процессов даже не создавался
+    assert encoder._executor is None
+    metrics = encoder.metrics.snapshot()
+    assert metrics["bytes_in"] == 5_000_000
+    assert metrics["bytes_saved"] == 5_000_000 - len(data)
+
+
+def test_prepare_reencodes_png_and_rejects_long_strip_for_photo():
+    async def scenario():
+        encoder = OutputEncoder(max_side=2560, workers=1)
+        data = make_image((100, 3000))
+        try:
+            return data, await encoder.prepare(data, original_size=len(data))
+        finally:
+            encoder.shutdown()
+
+    data, (encoded, as_photo) = run(scenario())
+    assert Image.open(io.BytesIO(encoded)).format == "JPEG"
+    assert max(image_size(encoded)) == 2560
+    assert not as_photo
+
+
+def test_unknown_original_size_is_not_counted_as_savings():
+    async def scenario():
+        encoder = OutputEncoder()
+        await encoder.prepare(make_image((300, 200), fmt="JPEG"), original_size=None)
+        return encoder.metrics.snapshot()
+
+    metrics = run(scenario())
+    assert metrics["images"] == 1
+    assert metrics["unmeasured"] == 1
+    assert metrics["bytes_in"] == 0
+    assert metrics["bytes_saved"] == 0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_original_refs_evict_oldest_over_limit():
+    refs = OriginalRefs(limit=2, ttl=100, clock=FakeClock())
+    first = refs.remember("a.png")
+    second = refs.remember("b.png")
+    third = refs.remember("c.png")
+    assert len(refs) == 2
+    assert refs.take(first) is None
+    assert refs.take(second) == "b.png"
+    assert refs.take(third) == "c.png"
+
+
+def test_original_refs_expire_after_ttl():
+    clock = FakeClock()
+    refs = OriginalRefs(limit=10, ttl=100, clock=clock)
+    old = refs.remember("old.png")
+    clock.now = 150
+    fresh = refs.remember("fresh.png")
+    # Устаревшая ссылка удалена при добавлении новой
+    assert len(refs) == 1
+    assert refs.take(old) is None
+    clock.now = 260
+    assert refs.take(fresh) is None
+
+
+def test_original_refs_take_restore_release():
+    refs = OriginalRefs(clock=FakeClock())
+    ref = refs.remember("a.png")
+
+    assert refs.take(ref) == "a.png"
+    # Повторное нажатие во время загрузки
+    assert refs.take(ref) is None
+    assert refs.is_taken(ref)
+
+    refs.restore(ref)
+    assert not refs.is_taken(ref)
+    assert refs.take(ref) == "a.png"
+
+    refs.release(ref)
+    assert not refs.is_taken(ref)
+    assert refs.take(ref) is None
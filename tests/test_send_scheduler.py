@@ -0,0 +1,137 @@
+"""
+Поведение SendScheduler на фейковом Bot
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from send_scheduler import (
+    SendScheduler, PRIORITY_MESSAGE, PRIORITY_PROGRESS, PRIORITY_RESULT
+)
+
+
+class FakeBot:
+    """Записывает запросы; flood - сколько раз ответить 429 для чата"""
+
+    def __init__(self, flood=None, retry_after=1):
+        self.calls = []
+        self.flood = dict(flood or {})
+        self.retry_after = retry_after
+
+    async def __call__(self, method):
+        loop = asyncio.get_running_loop()
+        if self.flood.get(method.chat_id):
+            self.flood[method.chat_id] -= 1
+            raise TelegramRetryAfter(method, "Flood control exceeded", self.retry_after)
+        self.calls.append((loop.time(), method.chat_id, method.text))
+        return method.text
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_pending_edits_are_coalesced():
+    async def scenario():
+        bot = FakeBot()
+        scheduler = SendScheduler(bot, global_rate=1000, chat_interval=0.05)
+        tasks = [asyncio.create_task(scheduler.send(SendMessage(chat_id=1, text="start")))]
+        tasks += [
+            asyncio.create_task(scheduler.send(
+                EditMessageText(chat_id=1, message_id=7, text=f"{i}%"),
+                priority=PRIORITY_PROGRESS
+            ))
+            for i in range(5)
+        ]
+        results = await asyncio.gather(*tasks)
+        await scheduler.stop()
+        return bot, results
+
+    bot, results = run(scenario())
+    assert [text for _, _, text in bot.calls] == ["start", "4%"]
+    assert results == ["start"] + ["4%"] * 5
+
+
+def test_results_go_before_progress():
+    async def scenario():
+        bot = FakeBot()
+        scheduler = SendScheduler(bot, global_rate=1000, chat_interval=0.01)
+        tasks = [
+            asyncio.create_task(scheduler.send(
+                EditMessageText(chat_id=1, message_id=7, text="progress"),
+                priority=PRIORITY_PROGRESS
+            )),
+            asyncio.create_task(scheduler.send(
+                SendMessage(chat_id=1, text="reply"), priority=PRIORITY_MESSAGE
+            )),
+            asyncio.create_task(scheduler.send(
+                SendMessage(chat_id=1, text="result"), priority=PRIORITY_RESULT
+            )),
+        ]
+        await asyncio.gather(*tasks)
+        await scheduler.stop()
+        return bot
+
+    bot = run(scenario())
+    assert [text for _, _, text in bot.calls] == ["result", "reply", "progress"]
+
+
+def test_retry_after_blocks_only_its_chat():
+    async def scenario():
+        bot = FakeBot(flood={1: 1}, retry_after=1)
+        scheduler = SendScheduler(bot, global_rate=1000, chat_interval=0.01)
+        start = asyncio.get_running_loop().time()
+        tasks = [
+            asyncio.create_task(scheduler.send(SendMessage(chat_id=1, text="a"))),
+            asyncio.create_task(scheduler.send(SendMessage(chat_id=1, text="b"))),
+            asyncio.create_task(scheduler.send(SendMessage(chat_id=2, text="other"))),
+        ]
+        await asyncio.gather(*tasks)
+        await scheduler.stop()
+        return bot, start
+
+    bot, start = run(scenario())
+    sent = {text: when - start for when, _, text in bot.calls}
+    assert sent["other"] < 0.5
+    assert sent["a"] >= 1
+    # Порядок внутри чата сохраняется и после 429
+    assert [text for _, chat_id, text in bot.calls if chat_id == 1] == ["a", "b"]
+
+
+def test_exhausted_retries_raise_original_error():
+    async def scenario():
+        bot = FakeBot(flood={1: 10}, retry_after=0)
+        scheduler = SendScheduler(bot, global_rate=1000, chat_interval=0.01, max_retries=2)
+        try:
+            await scheduler.send(SendMessage(chat_id=1, text="a"))
+        finally:
+            await scheduler.stop()
+
+    with pytest.raises(TelegramRetryAfter):
+        run(scenario())
+
+
+def test_methods_without_chat_are_rejected():
+    async def scenario():
+        scheduler = SendScheduler(FakeBot())
+        try:
+            await scheduler.send(AnswerCallbackQuery(callback_query_id="1"))
+        finally:
+            await scheduler.stop()
+
+    with pytest.raises(ValueError):
+        run(scenario())
+
+
+def test_invalid_rates_are_rejected():
+    with pytest.raises(ValueError):
+        SendScheduler(FakeBot(), global_rate=0)
+    with pytest.raises(ValueError):
+        SendScheduler(FakeBot(), chat_interval=-1)